@@ -0,0 +1,66 @@
+"""
+Compares standard json and orjson decoding of synthetic vManage route tables,
+and gzip transfer size of the same responses.
+
+Usage:
+    python benchmarks/json_decode.py [routes per device] [devices]
+"""
+import gzip
+import json
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import rest_api_lib  # noqa: E402
+
+
+def build_route_table(route_count, device):
+    """Builds JSON response similar to device/ip/routetable"""
+    data = []
+    for index in range(route_count):
+        data.append({
+            "vdevice-dataKey": device + "-" + str(index),
+            "vdevice-name": device,
+            "vdevice-host-name": "edge-" + device,
+            "vpn-id": str(index % 10),
+            "prefix": "10.%d.%d.0/24" % (index // 256 % 256, index % 256),
+            "nexthop-addr": "172.16.%d.%d" % (index // 256 % 256, index % 256),
+            "nexthop-ifname": "ge0/%d" % (index % 4),
+            "protocol": "omp",
+            "color": ["mpls", "biz-internet", "lte"][index % 3],
+            "encap": "ipsec",
+            "ip": "10.255.%d.%d" % (index // 256 % 256, index % 256),
+            "address-family": "ipv4",
+            "rstatus": "F,S",
+            "lastupdated": 1600000000000 + index,
+        })
+    return json.dumps({"header": {}, "data": data}).encode()
+
+
+def main():
+    route_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    device_count = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    responses = [build_route_table(route_count, "3.1.1.%d" % device) for device in range(device_count)]
+
+    raw_size = sum(len(response) for response in responses)
+    gzip_size = sum(len(gzip.compress(response)) for response in responses)
+    print("Devices:", device_count, "routes per device:", route_count)
+    print("Response size: %.1f MB, gzip: %.1f MB (%.0f%%)" % (
+        raw_size / 1e6, gzip_size / 1e6, 100.0 * gzip_size / raw_size))
+
+    def decode(loads):
+        for response in responses:
+            loads(response)["data"]
+
+    stdlib_time = min(timeit.repeat(lambda: decode(json.loads), number=1, repeat=3))
+    print("json.loads:   %.3f s" % stdlib_time)
+    if rest_api_lib.orjson:
+        orjson_time = min(timeit.repeat(lambda: decode(rest_api_lib.orjson.loads), number=1, repeat=3))
+        print("orjson.loads: %.3f s (%.1fx)" % (orjson_time, stdlib_time / orjson_time))
+    else:
+        print("orjson is not installed, pip install orjson to compare")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import queue
+import requests
+from sshtunnel import SSHTunnelForwarder  # ssh tunnel to jump host
+from rest_api_lib import rest_api_lib  # lib to make queries to vManage
+
+# Seconds between SSH keepalive packets, keeps idle tunnels open between queries
+SSH_KEEPALIVE_INTERVAL = 30
+
+
+class connection_pool:
+    """
+    Pool of vManage sessions. If jump hosts are given, every session uses its own SSH tunnel,
+    tunnels are spread across jump hosts round-robin.
+
+    get_request can be called from multiple threads, each call takes a free session from the pool,
+    so the number of parallel requests is limited by the pool size.
+    Dead tunnels and dropped sessions are reconnected on the next request.
+    """
+
+    def __init__(self, vmanage_ip, vmanage_port, username, password, jump_hosts=None, size=1):
+        self.vmanage_ip = vmanage_ip
+        self.vmanage_port = vmanage_port
+        self.username = username
+        self.password = password
+        self.size = size
+        self.connections = []
+        self.free_connections = queue.Queue()
+
+        for index in range(size):
+            connection = {
+                "jump_host": jump_hosts[index % len(jump_hosts)] if jump_hosts else "",
+                "tunnel": None,
+                "controller": None,
+            }
+            self.connections.append(connection)
+            try:
+                self.connect(connection)
+            except BaseException:
+                # don't leave tunnels already built running
+                self.stop()
+                raise
+            self.free_connections.put(connection)
+
+    def start_tunnel(self, connection):
+        """Builds SSH tunnel to vManage via the connection's jump host, or restarts it if it's down"""
+        tunnel = connection["tunnel"]
+        if tunnel is None:
+            tunnel = SSHTunnelForwarder(
+                connection["jump_host"],
+                ssh_username=self.username,
+                ssh_password=self.password,
+                remote_bind_address=(self.vmanage_ip, 443),
+                set_keepalive=SSH_KEEPALIVE_INTERVAL,
+            )
+            tunnel.daemon_forward_servers = True
+            tunnel.start()
+            connection["tunnel"] = tunnel
+        else:
+            tunnel.restart()
+
+        print(
+            "SSH tunnel established:", connection["jump_host"],
+            "Allocated local port:", tunnel.local_bind_port,
+        )  # show assigned local port
+
+    def is_tunnel_up(self, connection):
+        """Checks SSH tunnel is active and forwards traffic"""
+        tunnel = connection["tunnel"]
+        if tunnel is None or not tunnel.is_active:
+            return False
+        tunnel.check_tunnels()
+        return all(tunnel.tunnel_is_up.values())
+
+    def connect(self, connection):
+        """(Re)connects a pool connection: builds SSH tunnel if needed and logs in to vManage"""
+        if connection["jump_host"]:
+            if not self.is_tunnel_up(connection):
+                self.start_tunnel(connection)
+            # set vmanage host to local tunnel endpoint
+            host, port = "127.0.0.1", connection["tunnel"].local_bind_port
+        else:
+            host, port = self.vmanage_ip, self.vmanage_port
+
+        connection["controller"] = None
+        connection["controller"] = rest_api_lib(host, port, self.username, self.password)
+
+    def get_request(self, mount_point):
+        """GET request using a free connection from the pool"""
+        connection = self.free_connections.get()
+        try:
+            if connection["controller"] is None:
+                self.reconnect(connection)
+            try:
+                data = connection["controller"].get_request(mount_point)
+                if not self.is_logged_out(data):
+                    return data
+            except requests.exceptions.ConnectionError:
+                pass
+            # tunnel dropped or vManage logged the session out, reconnect and try once more
+            self.reconnect(connection)
+            return connection["controller"].get_request(mount_point)
+        finally:
+            self.free_connections.put(connection)
+
+    @staticmethod
+    def is_logged_out(data):
+        """vManage returns HTML login page instead of JSON when the session is logged out, same check as in login"""
+        return b'<html>' in data
+
+    def reconnect(self, connection):
+        """Reconnects a connection, any failure is reported as ConnectionError so the request can be retried later"""
+        try:
+            self.connect(connection)
+        except (Exception, SystemExit) as e:
+            # rest_api_lib exits on login failure, don't let a worker thread stop the script
+            raise requests.exceptions.ConnectionError("Could not reconnect to vManage: " + str(e))
+
+    def stop(self):
+        """Closes all SSH tunnels"""
+        tunnels = [connection["tunnel"] for connection in self.connections if connection["tunnel"]]
+        if any(tunnel.is_active for tunnel in tunnels):
+            print("Closing SSH tunnel connection...")
+            for tunnel in tunnels:
+                if tunnel.is_active:
+                    tunnel.stop()
+            print("")
@@ -0,0 +1,163 @@
+import ipaddress
+import re
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+# IPv4 address with optional prefix length, such as 10.20.30.0/24 or 10.20.30.40
+IPV4_PREFIX_REGEX = re.compile(r"^\s*(\d{1,3})\.(\d{1,3})\.(\d{1,3})\.(\d{1,3})(?:/(\d{1,2}))?\s*$")
+# Columns parsed to integer network and prefix length when data is collected
+PREFIX_INDEX_COLUMNS = ["prefix", "nexthop-addr"]
+# Prefix index is saved next to raw CSV file, rows are in the same order as in CSV
+PREFIX_INDEX_SUFFIX = ".prefix_index.npz"
+# Columns used to find longest prefix match per device and VPN
+LPM_GROUP_COLUMNS = ["deviceId", "vdevice-name", "vpn-id"]
+
+
+def parse_prefix(value):
+    """
+    Parses IPv4 prefix or address to integer network and prefix length, address without length is /32
+
+    :param value: string, for example 10.20.30.0/24
+    :return: tuple network, prefix length. Prefix length is -1 if value is not an IPv4 prefix
+    """
+    match = IPV4_PREFIX_REGEX.match(str(value))
+    if not match:
+        return 0, -1
+    octets = [int(octet) for octet in match.groups()[:4]]
+    prefix_length = int(match.group(5)) if match.group(5) else 32
+    if max(octets) > 255 or prefix_length > 32:
+        return 0, -1
+    network = (octets[0] << 24) | (octets[1] << 16) | (octets[2] << 8) | octets[3]
+    return network & int(prefix_mask(prefix_length)), prefix_length
+
+
+def parse_prefixes(column):
+    """
+    Parses column of IPv4 prefixes or addresses. Route tables from many devices mostly contain the same prefixes,
+    so every unique value is parsed only once
+
+    :param column: Series of strings
+    :return: tuple of numpy arrays - network, prefix length (-1 if not an IPv4 prefix)
+    """
+    codes, uniques = pd.factorize(column.astype(str))
+    parsed = np.array([parse_prefix(value) for value in uniques], dtype=np.int64).reshape(-1, 2)
+    return parsed[codes, 0], parsed[codes, 1]
+
+
+def prefix_mask(prefix_length):
+    """Converts prefix length (int or numpy array) to integer netmask"""
+    return (np.int64(0xFFFFFFFF) << (32 - prefix_length)) & 0xFFFFFFFF
+
+
+def build_prefix_index(dataframe, index_file):
+    """
+    Parses prefix and address columns to integers and saves them, so IP-aware conditions don't parse strings
+
+    :param dataframe: Dataframe saved to raw CSV file
+    :param index_file: prefix index file
+    :return: None
+    """
+    arrays = {}
+    for column in PREFIX_INDEX_COLUMNS:
+        if column in dataframe.columns:
+            arrays[column + ".network"], arrays[column + ".length"] = parse_prefixes(dataframe[column])
+
+    if arrays:
+        with open(index_file, "wb") as f:
+            np.savez(f, **arrays)
+    else:
+        # no prefix columns in this data source, remove index left from previous runs
+        Path(index_file).unlink(missing_ok=True)
+
+
+def load_prefix_index(index_file, row_count):
+    """
+    Loads prefix index saved by build_prefix_index
+
+    :param index_file: prefix index file
+    :param row_count: number of rows in raw CSV file, index isn't used if it doesn't match
+    :return: dictionary column: tuple network, prefix length arrays, or None if there's no valid index
+    """
+    try:
+        with np.load(index_file) as arrays:
+            prefix_index = {}
+            for column in PREFIX_INDEX_COLUMNS:
+                if column + ".network" in arrays:
+                    prefix_index[column] = (arrays[column + ".network"], arrays[column + ".length"])
+    except (FileNotFoundError, ValueError, OSError):
+        return None
+
+    if any(len(network) != row_count for network, _ in prefix_index.values()):
+        return None
+    return prefix_index
+
+
+def get_prefixes(dataframe, field, prefix_index):
+    """Gets network and prefix length arrays for Dataframe rows, from prefix index if available"""
+    if prefix_index and field in prefix_index:
+        positions = dataframe.index.to_numpy()
+        return prefix_index[field][0][positions], prefix_index[field][1][positions]
+    return parse_prefixes(dataframe[field])
+
+
+def filter_contains(dataframe, field, address, prefix_index=None):
+    """
+    Longest prefix match: keeps routes covering the address, only the most specific one per device and VPN
+
+    :param dataframe: routes Dataframe
+    :param field: column with prefixes, for example prefix
+    :param address: IPv4 address, for example 10.20.30.40
+    :param prefix_index: prefix index, see load_prefix_index
+    :return: filtered Dataframe
+    """
+    address = int(ipaddress.IPv4Address(address.strip()))
+    network, prefix_length = get_prefixes(dataframe, field, prefix_index)
+    covers = (prefix_length >= 0) & ((address & prefix_mask(np.maximum(prefix_length, 0))) == network)
+
+    result_pd = dataframe[covers]
+    prefix_length = pd.Series(prefix_length[covers], index=result_pd.index)
+
+    group_columns = [column for column in LPM_GROUP_COLUMNS if column in result_pd.columns]
+    if group_columns:
+        longest = prefix_length.groupby(
+            [result_pd[column] for column in group_columns], dropna=False
+        ).transform("max")
+    else:
+        longest = prefix_length.max()
+    return result_pd[prefix_length == longest]
+
+
+def filter_within(dataframe, field, cidr, prefix_index=None):
+    """
+    Keeps rows which prefix or address is inside the given network
+
+    :param dataframe: Dataframe
+    :param field: column with prefixes or addresses, for example prefix or nexthop-addr
+    :param cidr: IPv4 network, for example 10.20.0.0/16
+    :param prefix_index: prefix index, see load_prefix_index
+    :return: filtered Dataframe
+    """
+    cidr = ipaddress.IPv4Network(cidr.strip(), strict=False)
+    network, prefix_length = get_prefixes(dataframe, field, prefix_index)
+    inside = (prefix_length >= cidr.prefixlen) & ((network & int(cidr.netmask)) == int(cidr.network_address))
+    return dataframe[inside]
+
+
+def filter_prefixes(dataframe, field, operator, value, prefix_index=None):
+    """
+    Applies IP-aware condition to Dataframe
+
+    :param operator: contains or within
+    :param value: IPv4 address or network, or list of them - rows matching any of them are kept
+    :return: filtered Dataframe
+    :raises ValueError: if value is not a valid IPv4 address or network
+    """
+    filter_function = filter_contains if operator == "contains" else filter_within
+    if not isinstance(value, list):
+        return filter_function(dataframe, field, value, prefix_index)
+
+    matched_rows = set()
+    for item in value:
+        matched_rows.update(filter_function(dataframe, field, item, prefix_index).index)
+    return dataframe[dataframe.index.isin(matched_rows)]
@@ -0,0 +1,167 @@
+import gzip
+import importlib
+import queue
+import threading
+import pandas as pd
+
+# Output format: file extension
+OUTPUT_FORMATS = {
+    "csv": ".csv",
+    "csv.gz": ".csv.gz",
+    "parquet": ".parquet",
+    "jsonl": ".jsonl",
+    "xlsx": ".xlsx",
+}
+# Optional libraries required by output formats
+OUTPUT_FORMAT_LIBRARIES = {
+    "parquet": "pyarrow",
+    "xlsx": "openpyxl",
+}
+# Rows converted and written at once, only one chunk is converted at a time so memory stays bounded
+WRITE_CHUNK_SIZE = 100000
+
+
+def check_output_format(output_format):
+    """
+    Checks library required for output format is installed
+
+    :param output_format: one of OUTPUT_FORMATS
+    :raises ImportError: if required library isn't installed
+    """
+    library = OUTPUT_FORMAT_LIBRARIES.get(output_format)
+    if library:
+        try:
+            importlib.import_module(library)
+        except ImportError:
+            raise ImportError(
+                "Output format %s requires %s, install it with: pip install %s" % (output_format, library, library)
+            )
+
+
+class report_writer:
+    """
+    Writes Dataframes to a report file in a background thread, so the script can continue while the report is written.
+    Dataframes are written in chunks of WRITE_CHUNK_SIZE rows.
+    The file is created when the first Dataframe is written, so nothing is left behind if the script exits before.
+
+    Usage:
+        report = report_writer("reports/customera/routes", "csv.gz")
+        report.write(dataframe)
+        ...
+        report.close()  # waits until everything is written
+    """
+
+    def __init__(self, file_name, output_format="csv"):
+        """
+        :param file_name: report file name without extension, extension is added based on output format
+        :param output_format: one of OUTPUT_FORMATS
+        """
+        check_output_format(output_format)
+        self.file_name = file_name + OUTPUT_FORMATS[output_format]
+        self.output_format = output_format
+        self.dataframes = queue.Queue()
+        self.error = None
+        # set when close was called and all queued Dataframes were read
+        self.finished = False
+        # set when the first Dataframe is read, the file is created then
+        self.started = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, dataframe):
+        """Queues Dataframe to be written, returns immediately"""
+        self.dataframes.put(dataframe)
+
+    def close(self):
+        """
+        Waits until all queued Dataframes are written and closes the file
+
+        :return: report file name, or None if nothing was written
+        :raises: exception raised while writing the report
+        """
+        self.dataframes.put(None)
+        self.thread.join()
+        if self.error:
+            raise self.error
+        return self.file_name if self.started else None
+
+    def chunks(self):
+        """Yields chunks of queued Dataframes until close is called"""
+        while True:
+            dataframe = self.dataframes.get()
+            if dataframe is None:
+                self.finished = True
+                return
+            self.started = True
+            for start in range(0, max(len(dataframe.index), 1), WRITE_CHUNK_SIZE):
+                yield dataframe.iloc[start:start + WRITE_CHUNK_SIZE]
+
+    def run(self):
+        """Background thread, writes chunks in the output format"""
+        try:
+            if self.output_format == "parquet":
+                self.write_parquet()
+            elif self.output_format == "xlsx":
+                self.write_xlsx()
+            else:
+                self.write_text()
+        except Exception as e:
+            self.error = e
+            # keep reading the queue until close is called, unless it was already called - then the queue is empty
+            if not self.finished:
+                for _ in self.chunks():
+                    pass
+
+    def write_text(self):
+        """CSV, gzip CSV and JSON lines"""
+        f = None
+        try:
+            for chunk in self.chunks():
+                if f is None:
+                    if self.output_format == "csv.gz":
+                        f = gzip.open(self.file_name, "wt", newline="")
+                    else:
+                        f = open(self.file_name, "w", newline="")
+                    header = True
+                if self.output_format == "jsonl":
+                    if not chunk.empty:
+                        chunk.to_json(f, orient="records", lines=True)
+                else:
+                    chunk.to_csv(f, header=header, index=False)
+                header = False
+        finally:
+            if f:
+                f.close()
+
+    def write_parquet(self):
+        import pyarrow
+        import pyarrow.parquet
+
+        parquet_writer = None
+        try:
+            for chunk in self.chunks():
+                # object columns can mix numbers and strings, parquet needs a single type per column
+                chunk = chunk.astype({column: "string" for column in chunk.columns if chunk[column].dtype == object})
+                if parquet_writer is None:
+                    table = pyarrow.Table.from_pandas(chunk, preserve_index=False)
+                    parquet_writer = pyarrow.parquet.ParquetWriter(self.file_name, table.schema)
+                else:
+                    # all chunks must have the schema of the first one
+                    table = pyarrow.Table.from_pandas(chunk, schema=parquet_writer.schema, preserve_index=False)
+                parquet_writer.write_table(table)
+        finally:
+            if parquet_writer:
+                parquet_writer.close()
+
+    def write_xlsx(self):
+        excel_writer = None
+        try:
+            row = 0
+            for chunk in self.chunks():
+                if excel_writer is None:
+                    excel_writer = pd.ExcelWriter(self.file_name, engine="openpyxl")
+                chunk.to_excel(excel_writer, startrow=row, header=(row == 0), index=False)
+                row += len(chunk.index) + (1 if row == 0 else 0)
+        finally:
+            if excel_writer:
+                excel_writer.close()
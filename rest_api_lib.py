@@ -2,6 +2,25 @@ import requests
 import json
 import sys
 
+try:
+    import orjson  # optional fast JSON decoder, used if installed
+except ImportError:
+    orjson = None
+
+
+def json_loads(data):
+    """Decodes JSON bytes or string, using orjson if installed"""
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps(obj):
+    """Encodes object to JSON bytes, using orjson if installed"""
+    if orjson:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode()
+
 
 class rest_api_lib:
     def __init__(self, vmanage_ip, vmanage_port, username, password):
@@ -3,14 +3,21 @@ import csv
 import getpass
 import argparse
 import sys
+import os
+import re
 import pandas as pd
 import numpy as np
 import requests
+import sqlite3
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from tqdm import tqdm  # progress bar
 from colorama import init, Fore, Style  # colored screen output
-from sshtunnel import SSHTunnelForwarder  # ssh tunnel to jump host
-from rest_api_lib import rest_api_lib  # lib to make queries to vManage
+from connection_pool import connection_pool  # vManage sessions, via ssh tunnels to jump hosts if defined
+from rest_api_lib import json_loads, json_dumps  # JSON decoding, fast if orjson is installed
+from sql_engine import find_tables, find_device_conditions, run_sql_query  # SQLite backend for queries
+from report_writer import OUTPUT_FORMATS, check_output_format, report_writer  # CSV, Parquet, JSONL, Excel reports
+from prefix_match import PREFIX_INDEX_SUFFIX, build_prefix_index, load_prefix_index, filter_prefixes  # IP-aware conditions
 from pathlib import Path  # OS-agnostic file handling
 
 
@@ -30,6 +37,21 @@ HELP_STRING = 'Usage examples:\n' \
 # max lines for screen output
 SCREEN_ROW_COUNT = 30
 
+# Per-device checkpoint files and manifest are kept in this subdirectory of raw output, next to the raw CSV file
+CHECKPOINT_DIR_SUFFIX = "_checkpoint/"
+CHECKPOINT_MANIFEST = "manifest.json"
+# Device state when its data was collected is saved next to the device checkpoint file, used by --changed-only
+CHECKPOINT_STATE_SUFFIX = ".state.json"
+# How many times to retry devices which returned no data or failed during a sweep
+DEVICE_RETRY_COUNT = 2
+# Device inventory fields compared with the previous sweep in --changed-only mode,
+# if any of them changed, the device is queried again, otherwise data from the previous sweep is reused.
+# lastupdated is not used as vManage refreshes it on every statistics poll
+DEVICE_STATE_FIELDS = [
+    "uptime-date", "reachability", "status", "state", "ompPeers", "bfdSessions", "bfdSessionsUp",
+    "controlConnections", "version",
+]
+
 
 class CustomParser(argparse.ArgumentParser):
     """
@@ -110,6 +132,39 @@ def parse_args(args=sys.argv[1:]):
         "-p",
         help="Password. If not specified, ",
     )
+    optional.add_argument(
+        "--resume",
+        default=False,
+        action="store_true",
+        help="Continue an interrupted query from its checkpoint, only fetches pending and failed devices",
+    )
+    optional.add_argument(
+        "--changed-only",
+        default=False,
+        action="store_true",
+        help="Only query devices which state changed since the previous run, reuse previous data for other devices",
+    )
+    optional.add_argument(
+        "--engine",
+        default="pandas",
+        choices=["pandas", "sqlite"],
+        help="Query engine. sqlite runs the query as SQL on data sources loaded to in-memory SQLite database, "
+             "supports joins, aggregates and ORDER BY",
+    )
+    optional.add_argument(
+        "--output-format",
+        "-of",
+        default="csv",
+        choices=list(OUTPUT_FORMATS),
+        help="Report file format. parquet requires pyarrow, xlsx requires openpyxl",
+    )
+    optional.add_argument(
+        "--connections",
+        "-n",
+        default=1,
+        type=int,
+        help="Number of parallel connections to vManage. Each connection uses its own SSH tunnel if a jump host is defined",
+    )
     return parser.parse_args(args)
 
 
@@ -122,6 +177,7 @@ def command_analysis(text):
     select first_name,last_name from students where id = 5
     select * from students where first_name = "Mike" or "Andrew" and last_name = "Brown"
     select last_name from students where math_score = "90" or "80" and last_name = "Smith" and year = 7 or 8
+    select * from routes where prefix contains 10.20.30.40 and nexthop-addr within 172.16.0.0/16
 
     :return: Dictionary built from the input string, for example:
 
@@ -133,6 +189,8 @@ def command_analysis(text):
                         {'cond_field': 'year',
                          'cond_value': ['7',
                                         '8']}],
+
+        IP-aware conditions "contains" and "within" also have 'cond_operator' key
          'fields': ['*'],
          'source': 'students'}
 
@@ -173,6 +231,16 @@ def command_analysis(text):
                 # loop until everything has been sorted
                 for element in condition:
                     condition_dic = {}
+                    # IP-aware conditions: <field> contains <ip> or <field> within <cidr>, multiple values with 'or'
+                    ip_condition = re.match(r"^\s*(\S+)\s+(contains|within)\s+(.+?)\s*$", element, re.IGNORECASE)
+                    if ip_condition:
+                        values = re.split(r"\s+or\s+", ip_condition.group(3))
+                        condition_dic["cond_field"] = ip_condition.group(1)
+                        condition_dic["cond_operator"] = ip_condition.group(2).lower()
+                        condition_dic["cond_value"] = values if len(values) > 1 else values[0]
+                        conditions_list.append(ip_condition.group(1))
+                        conditions.append(condition_dic)
+                        continue
                     # split every condition by keyword '='
                     val = element.split("=")
                     condition_dic["cond_field"] = val[0].strip()
@@ -273,14 +341,14 @@ def print_to_csv_file(headers, content, file_name):
 # -------------------------------------------------------------------------------------------
 
 def process_csv_files(
-        join_dataframes, common_column, fields_to_select, sort_by, filter, file1, file2, result_file
+        join_dataframes, common_column, fields_to_select, sort_by, filter, file1, file2, report
 ):
     """
     Joins two dataframes.
     Input parameters:
          - common_column
          - two csv files to join
-    Writes raw output to a CSV file
+    Writes result to report, the report is written in background
     @param join_dataframes:
     @param common_column:
     @param fields_to_select:
@@ -288,31 +356,32 @@ def process_csv_files(
     @param filter:
     @param file1:
     @param file2:
-    @param result_file:
+    @param report: report_writer
+    @return: result Dataframe
     """
 
+    # Prefix index rows match file1 rows, can't be used after join
+    prefix_index = None
+
     if join_dataframes:
         pd1 = pd.read_csv(file1)
         pd2 = pd.read_csv(file2)
 
-        if fields_to_select[0] == "*":
-            result_pd = pd.merge(
-                pd1, pd2, left_on=common_column[0], right_on=common_column[1]
-            )
-        else:
-            result_pd = pd.merge(
-                pd1, pd2, left_on=common_column[0], right_on=common_column[1]
-            ).filter(fields_to_select)
+        source_pd = pd.merge(
+            pd1, pd2, left_on=common_column[0], right_on=common_column[1]
+        )
     else:
         # If "join_dataframes": false   is source_definition.json
         pd1 = pd.read_csv(file1)
-        if fields_to_select[0] == "*":
-            result_pd = pd1
-        else:
-            result_pd = pd1.filter(fields_to_select)
+        prefix_index = load_prefix_index(file1 + PREFIX_INDEX_SUFFIX, len(pd1.index))
+        source_pd = pd1
 
+    # Conditions are applied before selecting fields, so they can use fields which are not selected
     if filter:
         for filter_item in filter:
+            if "cond_operator" in filter_item:
+                # already applied
+                continue
             try:
                 # handle OR clause in SQL - add multiple filters
                 condition_sting = ""
@@ -329,18 +398,40 @@ def process_csv_files(
                     # no a list, just a single value - sting
                     condition_sting = filter_item["cond_value"]
 
-                result_pd = result_pd[
-                    result_pd[filter_item["cond_field"]]
+                source_pd = source_pd[
+                    source_pd[filter_item["cond_field"]]
                         .astype(str)
                         .str.contains(condition_sting, na=False)
                 ]
             except:
                 # simply ignore any exceptions, not filtered results
                 pass
+
+    # IP-aware conditions - longest prefix match or subnet match - are applied after other conditions,
+    # so the most specific route is found among matching routes only, for example only OMP routes.
+    # Longest prefix match is per device and VPN, these columns may be not selected
+    for filter_item in filter or []:
+        if "cond_operator" in filter_item:
+            try:
+                source_pd = filter_prefixes(
+                    source_pd, filter_item["cond_field"], filter_item["cond_operator"], filter_item["cond_value"],
+                    prefix_index,
+                )
+            except (ValueError, KeyError) as e:
+                print(Fore.RED + "Invalid condition", filter_item["cond_field"], filter_item["cond_operator"],
+                      filter_item["cond_value"], "-", str(e) + Style.RESET_ALL)
+                sys.exit(1)
+
+    if fields_to_select[0] == "*":
+        result_pd = source_pd
+    else:
+        result_pd = source_pd.filter(fields_to_select)
+
     # sort
     result_pd.sort_values(sort_by, inplace=True, ascending=True)
-    # output to CSV file
-    result_pd.to_csv(result_file, index=False)
+    # output to report file
+    report.write(result_pd)
+    return result_pd
 
 
 # -------------------------------------------------------------------------------------------
@@ -366,12 +457,14 @@ def get_vedges_details(customer, api_response_data, query_condition):
     devices_to_query = {}
     values_to_query = []
 
-    # if deviceId and hostname already specified in filter - 'where' condition, only query this device
-    # exception is when multiple device are there in 'when' condition - checking item["cond_value"] isn't a list
+    # if deviceId and hostname already specified in filter - 'where' condition, only query these devices
     for item in query_condition:
-        if "deviceId" in item["cond_field"] and not (isinstance(item["cond_value"], list)):
-            # Querying particular devices
-            device_list.append(item["cond_value"])
+        if "deviceId" in item["cond_field"]:
+            # Querying particular devices, a list if multiple devices are in 'where' condition
+            if isinstance(item["cond_value"], list):
+                device_list.extend(item["cond_value"])
+            else:
+                device_list.append(item["cond_value"])
             # already found deviceId - no need to get device list later
             found_device_id_in_filter = True
 
@@ -397,7 +490,7 @@ def get_vedges_details(customer, api_response_data, query_condition):
 
     # found deviceId in condition filter
     if found_device_id_in_filter:
-        return device_ids
+        return device_list
 
     # Get CSV Headers for vEdge devices
     csv_headers = []
@@ -449,9 +542,161 @@ def get_vedges_details(customer, api_response_data, query_condition):
 
 # -------------------------------------------------------------------------------------------
 
-def run_api_query_and_save_to_csv(customer, sdwan_controller, api_query, device_list, no_connect):
+def get_device_states(api_response_data):
+    """
+    Builds device state from vManage device inventory, used to detect changes between runs
+
+    :param api_response_data: JSON response with all devices from vManage
+    :return: dictionary deviceId: dictionary of DEVICE_STATE_FIELDS values
+    """
+    device_states = {}
+    for element in api_response_data:
+        device_states[element["deviceId"]] = {field: element.get(field) for field in DEVICE_STATE_FIELDS}
+    return device_states
+
+
+# -------------------------------------------------------------------------------------------
+
+def get_checkpoint_dir(customer, api_mount):
+    """
+    Builds checkpoint directory path for a data source and creates it if does not exist
+
+    :param customer: Customer name
+    :param api_mount: vManage API mount point, anything after ? is ignored
+    :return: checkpoint directory path
+    """
+    checkpoint_dir = get_file_path(customer, "", api_mount.split("?")[0], "raw_output") + CHECKPOINT_DIR_SUFFIX
+    Path(checkpoint_dir).mkdir(parents=True, exist_ok=True)
+    return checkpoint_dir
+
+
+# -------------------------------------------------------------------------------------------
+
+def load_checkpoint_manifest(checkpoint_dir, file_name=CHECKPOINT_MANIFEST):
+    """
+    Reads checkpoint manifest - lists of done, failed and pending devices
+
+    :param checkpoint_dir: checkpoint directory
+    :param file_name: manifest or device state file
+    :return: manifest dictionary, or None if there is no valid manifest
+    """
+    try:
+        with open(checkpoint_dir + file_name, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+# -------------------------------------------------------------------------------------------
+
+def save_checkpoint_manifest(checkpoint_dir, manifest, file_name=CHECKPOINT_MANIFEST):
+    """
+    Writes checkpoint manifest. Writes a temporary file first and then replaces the manifest,
+    so an interrupted run never leaves a half-written manifest.
+    Manifest is written after every device, so it's kept compact - no indentation
+
+    :param checkpoint_dir: checkpoint directory
+    :param manifest: manifest dictionary
+    :param file_name: manifest or device state file
+    :return: None
+    """
+    temp_file = checkpoint_dir + file_name + ".tmp"
+    with open(temp_file, "w") as f:
+        json.dump(manifest, f)
+    os.replace(temp_file, checkpoint_dir + file_name)
+
+
+# -------------------------------------------------------------------------------------------
+
+def fetch_device_to_checkpoint(sdwan_controller, api_query, device, checkpoint_dir, device_state=None):
+    """
+    Makes API query for a single device and saves the data returned to the device checkpoint file,
+    and the device state to the device state file
+
+    :param sdwan_controller: rest_api_lib instance
+    :param api_query: vManage API mount point, device ID is appended
+    :param device: device ID
+    :param checkpoint_dir: checkpoint directory
+    :param device_state: device state when data is collected, see get_device_states
+    :return: True if data saved, False if no data returned or request failed
+    """
+    try:
+        response = json_loads(sdwan_controller.get_request(api_query + device))
+        response_data = response["data"]
+    except (requests.exceptions.RequestException, ValueError, KeyError, TypeError):
+        # connection lost, logged out (vManage returns HTML login page) or no data returned
+        return False
+
+    for element in response_data:
+        element["deviceId"] = device
+
+    with open(checkpoint_dir + device + ".json", "wb") as f:
+        f.write(json_dumps(response_data))
+    if device_state is not None:
+        save_checkpoint_manifest(checkpoint_dir, device_state, device + CHECKPOINT_STATE_SUFFIX)
+    else:
+        # state file from a previous sweep doesn't match the new data
+        Path(checkpoint_dir + device + CHECKPOINT_STATE_SUFFIX).unlink(missing_ok=True)
+    return True
+
+
+# -------------------------------------------------------------------------------------------
+
+def fetch_devices_to_checkpoint(sdwan_controller, api_query, devices, checkpoint_dir, device_states, workers):
+    """
+    Queries devices in parallel with fetch_device_to_checkpoint and yields results as they complete.
+    At most workers requests are submitted at a time, so on Ctrl-C only requests already running are waited for
+
+    :param sdwan_controller: rest_api_lib instance
+    :param api_query: vManage API mount point, device ID is appended
+    :param devices: list of device IDs
+    :param checkpoint_dir: checkpoint directory
+    :param device_states: current device states, see get_device_states
+    :param workers: number of devices to query in parallel
+    :return: yields tuples device ID, True if data saved
+    """
+    devices = iter(devices)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        while True:
+            for device in devices:
+                futures[executor.submit(
+                    fetch_device_to_checkpoint, sdwan_controller, api_query, device, checkpoint_dir,
+                    (device_states or {}).get(device),
+                )] = device
+                if len(futures) >= workers:
+                    break
+            if not futures:
+                return
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield futures.pop(future), future.result()
+
+
+# -------------------------------------------------------------------------------------------
+
+def run_api_query_and_save_to_csv(
+        customer, sdwan_controller, api_query, device_list, no_connect, resume=False, workers=1, device_states=None,
+        changed_only=False,
+):
+    """
+    Makes API query for every device in device_list and saves combined output to raw CSV file
+
+    Data from every device is saved to a checkpoint file as soon as it's received, and a manifest
+    of done, failed and pending devices is updated, so an interrupted sweep can be continued with resume
+
+    :param customer: Customer name
+    :param sdwan_controller: rest_api_lib instance
+    :param api_query: vManage API mount point
+    :param device_list: list of device IDs to query
+    :param no_connect: don't make API queries, use previously collected CSV file
+    :param resume: continue from the checkpoint manifest, only query pending and failed devices
+    :param workers: number of devices to query in parallel, should not exceed sdwan_controller pool size
+    :param device_states: current device states, see get_device_states, saved with the data of every device queried
+    :param changed_only: don't query devices which state didn't change since the previous run, reuse their data
+    :return: number of rows collected
+    """
     rows_list = []
-    skipped_devices = []
 
     # If Do Not Connect flag is set, do not make API queries
     # The script uses the output .csv files previously collected
@@ -465,30 +710,89 @@ def run_api_query_and_save_to_csv(customer, sdwan_controller, api_query, device_
             return 0
         return len(df.index)
 
+    checkpoint_dir = get_checkpoint_dir(customer, api_query)
+    previous_manifest = load_checkpoint_manifest(checkpoint_dir)
+    if previous_manifest and previous_manifest["api_query"] != api_query:
+        previous_manifest = None
+
+    if resume and previous_manifest:
+        # Continue previous sweep - everything not done yet is pending, including failed devices
+        done_devices = [device for device in device_list if device in previous_manifest["done"]]
+        print(">>> Resuming from checkpoint,", len(done_devices), "device(s) already done")
+    elif changed_only and previous_manifest:
+        # Reuse data of devices which state is the same as when their data was collected
+        done_devices = [
+            device for device in device_list
+            if device in previous_manifest["done"]
+            and (device_states or {}).get(device) is not None
+            and load_checkpoint_manifest(checkpoint_dir, device + CHECKPOINT_STATE_SUFFIX) == device_states[device]
+        ]
+        print(">>> Reusing previous data for", len(done_devices), "unchanged device(s)")
+    else:
+        if resume or changed_only:
+            print(Fore.YELLOW + ">>> No checkpoint found for", api_query, "- starting a new query" + Style.RESET_ALL)
+        done_devices = []
+
+    # Remove device files left from previous runs, unless they are reused.
+    # State files of reused devices are kept as is - they still describe the data in the device file
+    for old_file in Path(checkpoint_dir).glob("*.json"):
+        if old_file.name == CHECKPOINT_MANIFEST:
+            continue
+        if old_file.name.endswith(CHECKPOINT_STATE_SUFFIX):
+            device = old_file.name[:-len(CHECKPOINT_STATE_SUFFIX)]
+        else:
+            device = old_file.name[:-len(".json")]
+        if device not in done_devices:
+            old_file.unlink()
+
+    manifest = {
+        "api_query": api_query,
+        "done": done_devices,
+        "failed": [],
+        "pending": [device for device in device_list if device not in done_devices],
+    }
+    save_checkpoint_manifest(checkpoint_dir, manifest)
+
     print(">>> Making API request to", api_query)
     # Initialise progress bar
-    pbar = tqdm(total=len(device_list), unit="dev")
+    pbar = tqdm(total=len(device_list), initial=len(done_devices), unit="dev")
     pbar.set_description("Processed devices")
 
-    for device in device_list:
-        response = json.loads(sdwan_controller.get_request(api_query + device))
+    # Manifest is only updated here, in the main thread, as device queries complete
+    for device, result in fetch_devices_to_checkpoint(
+            sdwan_controller, api_query, list(manifest["pending"]), checkpoint_dir, device_states, workers
+    ):
         pbar.set_description("Processing %s" % device)
+        manifest["pending"].remove(device)
+        if result:
+            manifest["done"].append(device)
+        else:
+            # if no data returned, skip the device for now, it's retried later
+            manifest["failed"].append(device)
+        save_checkpoint_manifest(checkpoint_dir, manifest)
         pbar.update(1)
-        try:
-            response_data = response["data"]
-        except:
-            # if no data returned, skip the device
-            skipped_devices.append(device)
-            continue
-        # pprint.pprint(response)
-        # ssh_tunnel.stop()
-        # exit(0)
-        # print("------------------------------", device, "------------------------------")
-        # print(json.dumps(response_data, sort_keys=True, indent=4))
+    pbar.close()
 
-        for element in response_data:
-            element["deviceId"] = device
-            rows_list.append(element)
+    # Retry devices which returned no data
+    for attempt in range(DEVICE_RETRY_COUNT):
+        if not manifest["failed"]:
+            break
+        print(">>> Retrying", len(manifest["failed"]), "device(s), attempt", attempt + 1)
+        for device, result in fetch_devices_to_checkpoint(
+                sdwan_controller, api_query, list(manifest["failed"]), checkpoint_dir, device_states, workers
+        ):
+            if result:
+                manifest["failed"].remove(device)
+                manifest["done"].append(device)
+                save_checkpoint_manifest(checkpoint_dir, manifest)
+
+    skipped_devices = manifest["failed"]
+
+    # Collect data from checkpoint files
+    for device in device_list:
+        if device in manifest["done"]:
+            with open(checkpoint_dir + device + ".json", "rb") as f:
+                rows_list.extend(json_loads(f.read()))
 
     # Got lists of lists, convert it to Dataframe
     df = pd.DataFrame(rows_list)
@@ -503,11 +807,17 @@ def run_api_query_and_save_to_csv(customer, sdwan_controller, api_query, device_
         df = df[new_columns]
         df.set_index("deviceId", inplace=True)
 
-    #  Dump dataframe to CSV, don't include anything after ? in the filename
-    df.to_csv(get_file_path(customer, "", api_query.split("?")[0], "raw_output") + ".csv")
+    #  Dump dataframe to CSV in background, don't include anything after ? in the filename
+    raw_file = get_file_path(customer, "", api_query.split("?")[0], "raw_output")
+    raw_report = report_writer(raw_file, "csv")
+    raw_report.write(df.reset_index() if df.index.name == "deviceId" else df)
+    # Parse prefixes and addresses once, for IP-aware conditions - contains and within
+    build_prefix_index(df, raw_file + ".csv" + PREFIX_INDEX_SUFFIX)
+    raw_report.close()
 
     if len(skipped_devices) > 0:
         print(Fore.RED + "\n>>> Check if these devices and reachable, couldn't get data from: ", skipped_devices)
+        print("Run again with --resume to retry only these devices")
         print(Style.RESET_ALL)
 
     return len(df.index)
@@ -515,17 +825,14 @@ def run_api_query_and_save_to_csv(customer, sdwan_controller, api_query, device_
 
 # -------------------------------------------------------------------------------------------
 
-def save_report_to_html(csv_file, html_file):
+def save_report_to_html(dataframe, html_file):
     """
-    Converts CVS file to HTML, applying CSS
+    Converts report Dataframe to HTML, applying CSS
 
-    :param csv_file: input CSV file
-    :param html_file: output HTML file, created in the same directory
+    :param dataframe: report Dataframe
+    :param html_file: output HTML file, created in the report directory
     :return:
     """
-    # reads source CSV, ignore first index column
-    dataframe = pd.read_csv(csv_file, index_col=False)
-
     # convert Dataframe to HTML, apply CSS
     html_string = '<link rel="stylesheet" href="../../html_css/style.css">' + dataframe.to_html(
         index=False, na_rep=" "
@@ -541,17 +848,6 @@ def save_report_to_html(csv_file, html_file):
     print("\nHTML Report saved as: " + str(Path(html_file).resolve()))
 
 
-# -------------------------------------------------------------------------------------------
-
-def stop_ssh_tunnel(ssh_tunnel):
-    # Received data, closing ssh tunnel
-    if ssh_tunnel:
-        if ssh_tunnel.is_active:
-            print("Closing SSH tunnel connection...")
-            ssh_tunnel.stop()
-            print("")
-
-
 # -------------------------------------------------------------------------------------------
 def main():
 
@@ -565,7 +861,17 @@ def main():
     options = parse_args()
 
     # Parse query from CLI input
-    query_processed = command_analysis(options.query)
+    if options.engine == "sqlite":
+        # SQL is run as written, only the data source after the first 'from' is needed to query vManage
+        from_clause = re.search(r"\bfrom\s+([\w-]+)", options.query, re.IGNORECASE)
+        query_processed = {
+            "source": from_clause.group(1) if from_clause else "",
+            # SQLite filters data itself, conditions are only used to select devices to query
+            "conditions": find_device_conditions(options.query),
+            "fields": ["*"],
+        }
+    else:
+        query_processed = command_analysis(options.query)
 
     # Analyse query
     source = query_processed["source"]
@@ -580,25 +886,31 @@ def main():
     with open("customers.json", "r") as f:
         customers_definitions = json.load(f)
 
+    api_query = ""
     for item in source_definitions:
         if item["data_source"] == source:
             api_query = item["api_mount"]
-
+    if not api_query:
+        print("No such data source:", source, "- see datasources.json")
+        exit(1)
 
     # Get customer name from CLI
     customer_name = options.customer
 
     vmanage_host = ""
-    jump_host = ""
+    jump_hosts = []
 
     # Get vManage and Jump Host details from customer definitions
     for item in customers_definitions:
         if item["customer"] == customer_name:
             vmanage_host = item["vmanage_ip"]
-            try:
-              jump_host = item["jump_host"]
-            except KeyError:
-               print("No jumphost defined, connecting directly...")
+            # a single jump_host or a list of jump_hosts to spread SSH tunnels across
+            if "jump_hosts" in item:
+                jump_hosts = item["jump_hosts"]
+            elif "jump_host" in item:
+                jump_hosts = [item["jump_host"]]
+            else:
+                print("No jumphost defined, connecting directly...")
     if not vmanage_host:
         # No such customer No vManage defined - existing program
         print(
@@ -607,8 +919,8 @@ def main():
         exit(1)
 
     print("Found vManage Host: ", vmanage_host)
-    if jump_host:
-        print(" Connecting via jumphost:", jump_host)
+    if jump_hosts:
+        print(" Connecting via jumphost:", ", ".join(jump_hosts))
 
     # Add DeviceID field if not already inclided
     if (
@@ -619,6 +931,13 @@ def main():
     ):
         fields_to_select.insert(0, "deviceId")
 
+    # Check libraries for report format are installed before making any queries
+    try:
+        check_output_format(options.output_format)
+    except ImportError as e:
+        print(Fore.RED + str(e) + Style.RESET_ALL)
+        exit(1)
+
     if options.password:
         password = options.password
     else:
@@ -631,96 +950,91 @@ def main():
     else:
         custom_report_dir = datetime.now().strftime('%Y-%m-%d')
 
-    # jump host is defined for a customer, build ssh tunnel
-    ssh_tunnel = ""
-    if jump_host:
-        try:
-            ssh_tunnel = SSHTunnelForwarder(
-                jump_host,
-                ssh_username=options.user,
-                ssh_password=password,
-                remote_bind_address=(vmanage_host, 443),
-            )
-            ssh_tunnel.daemon_forward_servers = True
-
-            ssh_tunnel.start()
-        except Exception as e:
-            print(str(e))
-            print("Jump host is defined, but can't connect to it, exiting...")
-            exit(1)
-
-        vmanage_connect_port = ssh_tunnel.local_bind_port
-
-        print(
-            "SSH tunnel established:", jump_host,
-            "Allocated local port:", ssh_tunnel.local_bind_port,
-        )  # show assigned local port
-        vmanage_host = "127.0.0.1"  # set vmanage host to local tunnel endpoint
-    # ssh tunnel has been built
-    else:
-        vmanage_connect_port = 8443
-
-    # Initialise vManage
+    # Initialise vManage connections, if jump host is defined for a customer, each one uses its own ssh tunnel
     try:
-        sdwan_controller = rest_api_lib(
-            vmanage_host, vmanage_connect_port, options.user, password
+        sdwan_controller = connection_pool(
+            vmanage_host, 8443, options.user, password, jump_hosts, max(options.connections, 1)
         )
-    except:
-        print(Fore.RED + "Could not connect to vManage, exiting...")
-        stop_ssh_tunnel(ssh_tunnel)
-        exit(0)
+    except (Exception, SystemExit) as e:
+        # rest_api_lib prints the reason and exits on login failure
+        if not isinstance(e, SystemExit):
+            print(str(e))
+        if jump_hosts:
+            print("Jump host is defined, but can't connect to vManage via it, exiting...")
+        else:
+            print(Fore.RED + "Could not connect to vManage, exiting...")
+        exit(1)
 
     # Get vEdge device details
-    response = json.loads(sdwan_controller.get_request("device"))
+    response = json_loads(sdwan_controller.get_request("device"))
     response_data = response["data"]
 
     # Get vEdges device IDs to query
     device_list = get_vedges_details(customer_name, response_data, query_condition)
+    device_states = get_device_states(response_data)
 
     print(Fore.GREEN + "Got", str(len(device_list)), "vEdge devices")
     print(Style.RESET_ALL)
 
     # Run the query
     dataframe_size = run_api_query_and_save_to_csv(
-        customer_name, sdwan_controller, api_query, device_list, options.no_connect
+        customer_name, sdwan_controller, api_query, device_list, options.no_connect, options.resume,
+        sdwan_controller.size, device_states, options.changed_only,
     )
 
     if dataframe_size == 0:
         print(Fore.RED + "API query returned no data")
-        stop_ssh_tunnel(ssh_tunnel)
+        sdwan_controller.stop()
         exit(0)
 
-    # Received data, don't need ssh tunnel anymore, closing connection
-    stop_ssh_tunnel(ssh_tunnel)
-
-    # sorting by first column - fields_to_select[0] and then second fields_to_select[1]
-    # TODO: implement sort by in SQL parser
-    if fields_to_select[0] == "*":
-        sort_by = ["deviceId"]
+    # Received data, don't need ssh tunnels anymore, closing connections
+    sdwan_controller.stop()
+
+    # Report is written in background, while results are printed
+    report_file = get_file_path(customer_name, custom_report_dir, api_query.split("?")[0], "report")
+    report = report_writer(report_file, options.output_format)
+
+    if options.engine == "sqlite":
+        # Load data sources used in query, other data sources must have been collected before
+        api_mounts = {item["data_source"]: item["api_mount"] for item in source_definitions}
+        tables = {}
+        for data_source in find_tables(options.query, list(api_mounts)):
+            raw_file = get_file_path(customer_name, "", api_mounts[data_source].split("?")[0], "raw_output") + ".csv"
+            if Path(raw_file).is_file():
+                tables[data_source] = raw_file
+            else:
+                print(Fore.YELLOW + "No data collected for", data_source, "- query it first" + Style.RESET_ALL)
+        try:
+            result_pd = run_sql_query(options.query, tables)
+        except (sqlite3.Error, pd.errors.DatabaseError) as e:
+            print(Fore.RED + "SQL query failed:", str(e) + Style.RESET_ALL)
+            report.close()
+            exit(1)
+        report.write(result_pd)
     else:
-        sort_by = [fields_to_select[0],fields_to_select[1]]
-
-    # Process CSV files and generate reports
-    process_csv_files(
-        False,
-        "",
-        fields_to_select,
-        sort_by,
-        query_condition,
-        get_file_path(customer_name, "", api_query.split("?")[0], "raw_output") + ".csv",
-        "",
-        get_file_path(customer_name, custom_report_dir, api_query.split("?")[0], "report") + ".csv",
-    )
-
-    # print result CSV file to screen unless it's set to False is CLI arguments
-    if options.screen_output:
-        df = pd.read_csv(
-            get_file_path(customer_name, custom_report_dir, api_query.split("?")[0], "report") + ".csv",
-            index_col=0,
+        # sorting by first column - fields_to_select[0] and then second fields_to_select[1]
+        # TODO: implement sort by in SQL parser
+        if fields_to_select[0] == "*":
+            sort_by = ["deviceId"]
+        else:
+            sort_by = [fields_to_select[0],fields_to_select[1]]
+
+        # Process CSV files and generate reports
+        result_pd = process_csv_files(
+            False,
+            "",
+            fields_to_select,
+            sort_by,
+            query_condition,
+            get_file_path(customer_name, "", api_query.split("?")[0], "raw_output") + ".csv",
+            "",
+            report,
         )
 
+    # print result to screen unless it's set to False is CLI arguments
+    if options.screen_output:
         # Get number of rows and columns in Dataframe
-        count_row = len(df)
+        count_row = len(result_pd)
 
         if count_row > SCREEN_ROW_COUNT:
             print(
@@ -728,11 +1042,11 @@ def main():
                 count_row,
                 "but printed only first",
                 SCREEN_ROW_COUNT,
-                ". Check CVS file for full output",
+                ". Check report file for full output",
             )
         print("-" * 80)
         if count_row > 0:
-            print(df.head(SCREEN_ROW_COUNT))
+            print(result_pd.head(SCREEN_ROW_COUNT).to_string(index=False))
             print(Fore.GREEN + "Returned", count_row, "record(s)")
         else:
             print(Fore.RED + "Returned 0 record(s)")
@@ -741,10 +1055,16 @@ def main():
         print("-" * 80)
 
     if options.html_output:
-        save_report_to_html(
-            get_file_path(customer_name, custom_report_dir, api_query.split("?")[0], "report") + ".csv",
-            get_file_path(customer_name, custom_report_dir, api_query.split("?")[0], "report") + ".html",
-        )
+        save_report_to_html(result_pd, report_file + ".html")
+
+    # wait until report is written
+    try:
+        report_file = report.close()
+        if report_file:
+            print("Report saved as: " + str(Path(report_file).resolve()))
+    except Exception as e:
+        print(Fore.RED + "Could not write report:", str(e) + Style.RESET_ALL)
+        exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,144 @@
+import re
+import sqlite3
+import pandas as pd
+
+# Rows inserted to SQLite per batch when loading raw CSV files
+LOAD_CHUNK_SIZE = 50000
+# Columns indexed in every loaded table if present, used to filter and join tables by device
+INDEXED_COLUMNS = ["deviceId", "vdevice-name", "vdevice-host-name"]
+# Columns used to select devices to query from vManage, same as in get_vedges_details
+DEVICE_COLUMNS = ["deviceId", "host-name", "site-id"]
+# SQL keywords which are never quoted, even if a data source has a column with the same name
+SQL_KEYWORDS = {
+    "select", "distinct", "from", "where", "and", "or", "not", "as", "on", "join", "inner", "left", "outer", "cross",
+    "using", "group", "order", "by", "having", "limit", "offset", "in", "is", "null", "like", "glob", "between",
+    "case", "when", "then", "else", "end", "asc", "desc", "union", "all", "except", "intersect", "exists",
+}
+
+
+def find_tables(query, table_names):
+    """
+    Finds data sources used in SQL query
+
+    :param query: SQL query string
+    :param table_names: list of data source names
+    :return: list of data source names found in query
+    """
+    return [name for name in table_names if re.search(r"(?<![\w-])" + re.escape(name) + r"(?![\w-])", query)]
+
+
+def find_device_conditions(query):
+    """
+    Finds conditions selecting devices - deviceId, host-name or site-id - in SQL query WHERE clause,
+    so only these devices are queried from vManage.
+    Conditions are only used if WHERE clause has no OR, NOT or subqueries, otherwise all devices are queried.
+    Only the table after FROM is queried from vManage, so if the query joins tables, only conditions
+    qualified with this table's name or alias are used
+
+    :param query: SQL query string
+    :return: list of conditions in command_analysis format, for example:
+        [{'cond_field': 'vdevice-host-name', 'cond_value': 'jc7003edge01'},
+         {'cond_field': 'site-id', 'cond_value': ['220', '183']}]
+    """
+    where = re.search(r"\bwhere\b(.*?)(?:\bgroup\s+by\b|\border\s+by\b|\blimit\b|$)", query, re.IGNORECASE | re.DOTALL)
+    if not where or re.search(r"\b(or|not|select)\b", where.group(1), re.IGNORECASE):
+        return []
+
+    # table after FROM, its optional alias and the rest of FROM clause - joined tables if any
+    keywords = "|".join(SQL_KEYWORDS)
+    from_clause = re.search(
+        r"\bfrom\s+([\w-]+)(?:\s+(?:as\s+)?(?!(?:" + keywords + r")\b)([\w-]+))?(.*?)\bwhere\b",
+        query,
+        re.IGNORECASE | re.DOTALL,
+    )
+    if not from_clause:
+        return []
+    table_names = {name.lower() for name in from_clause.group(1, 2) if name}
+    single_table = not from_clause.group(3).strip()
+
+    conditions = []
+    value = r"(?:'[^']*'|[\w.-]+)"
+    for match in re.finditer(
+            r"(?:([\w-]+)\.)?\"?([\w-]+)\"?\s*(?:=\s*(" + value + r")|\bin\s*\(([^)]*)\))",
+            where.group(1),
+            re.IGNORECASE,
+    ):
+        table, column = match.group(1, 2)
+        if not any(device_column in column for device_column in DEVICE_COLUMNS):
+            continue
+        # condition on another table, or unqualified column which can be in any of joined tables
+        if (table.lower() not in table_names) if table else not single_table:
+            continue
+        if match.group(3):
+            values = [match.group(3)]
+        else:
+            values = re.findall(value, match.group(4))
+        values = [item.strip("'") for item in values]
+        conditions.append({"cond_field": column, "cond_value": values[0] if len(values) == 1 else values})
+    return conditions
+
+
+def quote_identifiers(query, column_names):
+    """
+    Quotes column names, so names such as vdevice-host-name or SQL keywords such as index
+    can be written in query as is. String literals and function calls aren't changed
+
+    :param query: SQL query string
+    :param column_names: column names of all tables used in query
+    :return: SQL query string with quoted column names
+    """
+    names = [name for name in set(column_names) if name.lower() not in SQL_KEYWORDS]
+    if not names:
+        return query
+    # longest names first, so a name which is a part of another name isn't quoted inside it
+    names_regex = re.compile(
+        r"(?<![\w\"-])("
+        + "|".join(re.escape(name) for name in sorted(names, key=len, reverse=True))
+        + r")(?![\w\"-])(?!\s*\()"
+    )
+    # odd parts are string literals
+    parts = re.split(r"('(?:[^']|'')*')", query)
+    for index in range(0, len(parts), 2):
+        parts[index] = names_regex.sub(r'"\1"', parts[index])
+    return "".join(parts)
+
+
+def load_table(connection, table_name, csv_file):
+    """
+    Loads raw CSV file to SQLite table in chunks and indexes device columns
+
+    :param connection: SQLite connection
+    :param table_name: data source name, used as table name
+    :param csv_file: raw CSV file
+    :return: list of column names
+    """
+    columns = []
+    for chunk in pd.read_csv(csv_file, chunksize=LOAD_CHUNK_SIZE, low_memory=False):
+        chunk.to_sql(table_name, connection, if_exists="append" if columns else "replace", index=False)
+        columns = chunk.columns.tolist()
+
+    for column in INDEXED_COLUMNS:
+        if column in columns:
+            connection.execute(
+                'CREATE INDEX "idx_%s_%s" ON "%s" ("%s")' % (table_name, column, table_name, column)
+            )
+    return columns
+
+
+def run_sql_query(query, tables):
+    """
+    Runs SQL query on data sources loaded to in-memory SQLite database
+
+    :param query: SQL query, data source names are used as table names
+    :param tables: dictionary data source name: raw CSV file
+    :return: result Dataframe
+    """
+    connection = sqlite3.connect(":memory:")
+    try:
+        column_names = []
+        for table_name, csv_file in tables.items():
+            column_names.extend(load_table(connection, table_name, csv_file))
+
+        return pd.read_sql_query(quote_identifiers(query, column_names), connection)
+    finally:
+        connection.close()